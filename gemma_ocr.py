@@ -1,16 +1,18 @@
-import base64
-import io
+import functools
+import hashlib
 import json
 import logging
 import os
-import re
+from collections.abc import Callable
 from pathlib import Path
 
 import ollama
-from PIL import Image
+from json_repair import repair_json
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
 
+from ocr_image_utils import image_to_jpeg_bytes, image_to_jpeg_bytes_from_bytes
+
 # Initialize colorama
 init(autoreset=True)
 
@@ -26,54 +28,35 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma:7b")
+# q4_K_M is a k-quant 4-bit build that keeps more accuracy than the q4_0 weights
+# behind the plain gemma:7b tag at a similar size and speed. Use
+# gemma:7b-instruct-fp16 for full precision.
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma:7b-instruct-q4_K_M")
+# How long Ollama keeps the model loaded after a request, avoiding cold starts.
+# Sent as a Go duration string (e.g. "30m", "1h"); deliberately not named
+# OLLAMA_KEEP_ALIVE, whose server-side format (-1, plain seconds) differs.
+OCR_KEEP_ALIVE = os.getenv("OCR_KEEP_ALIVE", "30m")
+OCR_CACHE_DIR = Path(os.getenv("OCR_CACHE_DIR", "~/.cache/gemma_ocr")).expanduser()
+# Bump whenever the OCR prompt or result parsing changes so stale cached
+# results are not reused (v3: v2 entries may hold big integers rounded to floats)
+PROMPT_VERSION = 3
 
-def validate_image_path(image_path: str) -> None:
-    """Validate if the image path exists and is a valid image file."""
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Image file not found: {image_path}")
-    
-    valid_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
-    if not Path(image_path).suffix.lower() in valid_extensions:
-        raise ValueError(f"Invalid image format. Supported formats: {valid_extensions}")
+@functools.lru_cache(maxsize=4)
+def _get_client(host: str) -> ollama.Client:
+    """Return a shared Ollama client per host so HTTP connections are reused."""
+    return ollama.Client(host=host)
 
-def load_image(image_path: str) -> Image.Image:
-    """Load an image file using PIL."""
-    validate_image_path(image_path)
-    return Image.open(image_path)
+def warm_up_model(host: str = OLLAMA_HOST, model: str = OLLAMA_MODEL) -> None:
+    """Load the model on the Ollama host ahead of the first OCR request.
 
-def image_to_base64(image_path: str, max_size_mb: float = 10.0) -> str:
-    """Convert an image file to base64 string with size-aware resizing."""
+    An empty prompt only loads the model; keep_alive then holds it resident.
+    Failures are logged and ignored since the first OCR call loads it anyway.
+    """
     try:
-        with load_image(image_path) as image:
-            original_width, original_height = image.size
-            original_size = os.path.getsize(image_path) / (1024 * 1024)  # Size in MB
-            logger.info(f"Original image size: {original_width}x{original_height}, {original_size:.2f}MB")
-
-            # Start with standard resize
-            long_side = max(original_width, original_height)
-            scale_factor = 1024 / long_side
-            new_width = int(original_width * scale_factor)
-            new_height = int(original_height * scale_factor)
-
-            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Try different quality levels if needed
-            quality = 95
-            while True:
-                buffered = io.BytesIO()
-                resized_image.save(buffered, format="JPEG", quality=quality, optimize=True)
-                size_mb = len(buffered.getvalue()) / (1024 * 1024)
-                
-                if size_mb <= max_size_mb or quality <= 30:
-                    logger.info(f"Final image size: {new_width}x{new_height}, {size_mb:.2f}MB (quality={quality})")
-                    return base64.b64encode(buffered.getvalue()).decode("utf-8")
-                
-                # Reduce quality and try again
-                quality -= 10
+        _get_client(host).generate(model=model, prompt="", keep_alive=OCR_KEEP_ALIVE)
+        logger.info(f"Warmed up model {model} on {host}")
     except Exception as e:
-        logger.error(f"{Fore.RED}Failed to process image {image_path}: {str(e)}{Style.RESET_ALL}")
-        raise
+        logger.warning(f"Failed to warm up model {model}: {str(e)}")
 
 def perform_ocr(image_path: str, host: str = OLLAMA_HOST, model: str = OLLAMA_MODEL) -> dict:
     """Process an image with OCR using Gemma model via Ollama.
@@ -81,7 +64,7 @@ def perform_ocr(image_path: str, host: str = OLLAMA_HOST, model: str = OLLAMA_MO
     Args:
         image_path: Path to the image file
         host: Ollama API host (default: from environment or localhost)
-        model: Model name to use (default: from environment or gemma:7b)
+        model: Model name to use (default: from environment or gemma:7b-instruct-q4_K_M)
     
     Returns:
         dict: Extracted text as JSON object with key-value pairs
@@ -92,13 +75,67 @@ def perform_ocr(image_path: str, host: str = OLLAMA_HOST, model: str = OLLAMA_MO
         Exception: For other processing errors
     """
     logger.info(f"{Fore.GREEN}Processing image with Ollama Gemma: {image_path}{Style.RESET_ALL}")
-    
+    return _run_ocr(image_to_jpeg_bytes(image_path), host, model)
+
+def perform_ocr_bytes(
+    data: bytes,
+    host: str = OLLAMA_HOST,
+    model: str = OLLAMA_MODEL,
+    on_token: Callable[[str], None] | None = None,
+) -> dict:
+    """Process in-memory image bytes with OCR using Gemma model via Ollama.
+
+    Same as perform_ocr, but skips the round-trip through a file on disk.
+
+    Args:
+        data: Raw image file contents (e.g. a Streamlit upload)
+        host: Ollama API host (default: from environment or localhost)
+        model: Model name to use (default: from environment or gemma:7b-instruct-q4_K_M)
+        on_token: Optional callback receiving response tokens as they stream in
+
+    Returns:
+        dict: Extracted text as JSON object with key-value pairs
+    """
+    logger.info(f"{Fore.GREEN}Processing in-memory image with Ollama Gemma ({len(data)} bytes){Style.RESET_ALL}")
+    return _run_ocr(image_to_jpeg_bytes_from_bytes(data), host, model, on_token)
+
+def _cache_path(jpeg_image: bytes, model: str) -> Path:
+    """Return the cache file for an encoded image, model and prompt version."""
+    key = hashlib.blake2b(jpeg_image, digest_size=16)
+    key.update(f":{model}:v{PROMPT_VERSION}".encode("utf-8"))
+    return OCR_CACHE_DIR / f"{key.hexdigest()}.json"
+
+def _run_ocr(
+    jpeg_image: bytes, host: str, model: str, on_token: Callable[[str], None] | None = None
+) -> dict:
+    """Return the cached OCR result for an image, querying Gemma on a miss."""
+    cache_path = _cache_path(jpeg_image, model)
     try:
-        # Convert image to base64
-        base64_image = image_to_base64(image_path)
-        
-        # Initialize Ollama client
-        client = ollama.Client(host=host)
+        result = json.loads(cache_path.read_bytes())
+        logger.info(f"Using cached OCR result: {cache_path.name}")
+        return result
+    except (OSError, json.JSONDecodeError):
+        pass
+
+    result = _query_ocr(jpeg_image, host, model, on_token)
+    try:
+        OCR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(result), encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"Failed to cache OCR result: {str(e)}")
+    return result
+
+def _query_ocr(
+    jpeg_image: bytes, host: str, model: str, on_token: Callable[[str], None] | None = None
+) -> dict:
+    """Send a JPEG encoded image to Gemma and parse the JSON response.
+
+    When on_token is given the response is streamed and each token is passed
+    to it as it arrives.
+    """
+    try:
+        # Reuse the Ollama client for this host
+        client = _get_client(host)
         
         # Process with Gemma
         response = client.chat(
@@ -108,17 +145,13 @@ def perform_ocr(image_path: str, host: str = OLLAMA_HOST, model: str = OLLAMA_MO
                 "top_p": 0.9,
                 "top_k": 40,
             },
+            # JSON mode guarantees a parseable object, no extraction needed
+            format="json",
             messages=[
                 {
                     "role": "system",
                     "content": """You are an AI assistant that recognizes text in images. Images will contain labels, tables, or documents.
-                    Format all responses as valid JSON objects with key-value pairs.
-                    Rules:
-                    1. Response must start with an opening curly brace {
-                    2. Each key-value pair must be properly quoted
-                    3. Response must end with a closing curly brace }
-                    4. No additional text or explanation should be included
-                    5. Extract all visible text from the image""",
+                    Format all responses as JSON objects with key-value pairs and extract all visible text from the image.""",
                 },
                 {
                     "role": "user",
@@ -131,50 +164,37 @@ def perform_ocr(image_path: str, host: str = OLLAMA_HOST, model: str = OLLAMA_MO
                            ...
                         }
                         """,
-                    "images": [base64_image],
+                    "images": [jpeg_image],
                 },
             ],
-            stream=False,
+            stream=on_token is not None,
+            keep_alive=OCR_KEEP_ALIVE,
         )
 
+        if on_token is not None:
+            # Forward tokens as they arrive and assemble the full message
+            parts = []
+            for chunk in response:
+                token = chunk["message"]["content"]
+                parts.append(token)
+                on_token(token)
+            response = {"message": {"content": "".join(parts)}}
+
         if "message" in response and "content" in response["message"]:
             content = response["message"]["content"].strip()
             logger.info(f"Raw response content:\n{content}")
-            # First try to extract JSON using regex
-            json_pattern = r"\{.*\}"
-            match = re.search(json_pattern, content, re.DOTALL)
-            if match:
-                json_str = match.group(0)
-                logger.info(f"Extracted JSON string:\n{json_str}")
-                try:
-                    # Validate JSON by parsing it
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
-                    # If JSON is invalid, clean up common issues
-                    # Remove trailing commas
-                    cleaned = re.sub(r',\s*}', '}', json_str)
-                    # Fix missing commas
-                    cleaned = re.sub(r'(?<![\{\s,])\s*"', ' "', cleaned)
-                    # Remove extra spaces in keys and values
-                    cleaned = re.sub(r'"\s*([^"]+)\s*":', '"\1":', cleaned)
-                    cleaned = re.sub(r':\s*"([^"]+)\s*"', ':"\1"', cleaned)
-                    # Handle standalone text at the end
-                    cleaned = re.sub(r'\s*"([^"]+)\."\s*}', '', cleaned)
-                    cleaned = re.sub(r'\s*([^"\s]+\.)\s*}', '', cleaned)
-                    cleaned = cleaned.rstrip() + '}'
-                    
-                    # Handle duplicate keys by parsing and rebuilding
-                    try:
-                        data = json.loads(cleaned)
-                        # Convert to dict to automatically handle duplicates
-                        # (later values override earlier ones)
-                        result = dict(data)
-                        return result
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Failed to parse cleaned JSON: {e}")
-                        raise
-            else:
+            # Parse with stdlib json: orjson turns integers wider than 64 bits
+            # (serial/tracking numbers) into floats and loses digits
+            try:
+                result = json.loads(content)
+            except json.JSONDecodeError:
+                # Fall back to repairing truncated or slightly malformed output
+                logger.warning("Invalid JSON in response, attempting repair")
+                result = json.loads(repair_json(content))
+            # Repair turns prose into "" and may yield arrays; never return (or cache) those
+            if not isinstance(result, dict) or not result:
                 raise ValueError("No JSON object found in response")
+            return result
         raise ValueError("Invalid response format from Ollama API")
     except Exception as e:
         logger.error(f"{Fore.RED}Error in Ollama Gemma OCR process: {str(e)}{Style.RESET_ALL}")
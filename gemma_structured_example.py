@@ -1,17 +1,15 @@
-import base64
-import io
-import json
+import functools
 import logging
 import os
-import re
-from pathlib import Path
 
+import orjson
 from ollama import Client
-from PIL import Image
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
 from pydantic import BaseModel
 
+from ocr_image_utils import image_to_jpeg_bytes
+
 # Initialize colorama for colored terminal output
 init(autoreset=True)
 
@@ -27,7 +25,9 @@ logger = logging.getLogger(__name__)
 
 # Default configuration for Ollama API
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma:7b")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma:7b-instruct-q4_K_M")
+# How long Ollama keeps the model loaded after a request (see gemma_ocr.py)
+OCR_KEEP_ALIVE = os.getenv("OCR_KEEP_ALIVE", "30m")
 
 # =============================================================================
 # Pydantic Model for Structured Output
@@ -51,76 +51,16 @@ class Label(BaseModel):
     Serial_Number: str
 
 # =============================================================================
-# Image Processing Functions
+# Ollama Client
 # =============================================================================
-def validate_image_path(image_path: str) -> None:
-    """Validate if the image path exists and is a valid image file.
-    
-    Args:
-        image_path: Path to the image file to validate
-    
-    Raises:
-        FileNotFoundError: If image doesn't exist
-        ValueError: If image format is not supported
-    """
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Image file not found: {image_path}")
-    
-    valid_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
-    if not Path(image_path).suffix.lower() in valid_extensions:
-        raise ValueError(f"Invalid image format. Supported formats: {valid_extensions}")
+@functools.lru_cache(maxsize=4)
+def _get_client(host: str) -> Client:
+    """Return a shared Ollama client per host.
 
-def load_image(image_path: str) -> Image.Image:
-    """Load an image file using PIL."""
-    validate_image_path(image_path)
-    return Image.open(image_path)
-
-def image_to_base64(image_path: str, max_size_mb: float = 10.0) -> str:
-    """Convert an image file to base64 string with size-aware resizing.
-    
-    This function:
-    1. Loads the image and gets original dimensions
-    2. Resizes to max 1024px on longest side
-    3. Compresses with adjustable JPEG quality
-    4. Ensures output is under max_size_mb
-    
-    Args:
-        image_path: Path to image file
-        max_size_mb: Maximum allowed size in MB (default: 10MB)
-    
-    Returns:
-        str: Base64 encoded image data
+    Each Client owns its own HTTP connection pool, so reusing it avoids a new
+    TCP/TLS handshake on every OCR call against remote hosts.
     """
-    try:
-        with load_image(image_path) as image:
-            original_width, original_height = image.size
-            original_size = os.path.getsize(image_path) / (1024 * 1024)  # Size in MB
-            logger.info(f"Original image size: {original_width}x{original_height}, {original_size:.2f}MB")
-
-            # Scale image to 1024px on longest side
-            long_side = max(original_width, original_height)
-            scale_factor = 1024 / long_side
-            new_width = int(original_width * scale_factor)
-            new_height = int(original_height * scale_factor)
-
-            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Try different JPEG quality levels until size is under limit
-            quality = 95
-            while True:
-                buffered = io.BytesIO()
-                resized_image.save(buffered, format="JPEG", quality=quality, optimize=True)
-                size_mb = len(buffered.getvalue()) / (1024 * 1024)
-                
-                if size_mb <= max_size_mb or quality <= 30:
-                    logger.info(f"Final image size: {new_width}x{new_height}, {size_mb:.2f}MB (quality={quality})")
-                    return base64.b64encode(buffered.getvalue()).decode("utf-8")
-                
-                # Reduce quality and try again
-                quality -= 10
-    except Exception as e:
-        logger.error(f"{Fore.RED}Failed to process image {image_path}: {str(e)}{Style.RESET_ALL}")
-        raise
+    return Client(host=host)
 
 # =============================================================================
 # Main OCR Function with Structured Output
@@ -129,7 +69,7 @@ def perform_structured_ocr(image_path: str, host: str = OLLAMA_HOST, model: str
     """Process an image with OCR using Gemma model via Ollama with structured output validation.
     
     Key steps:
-    1. Convert image to base64
+    1. Convert image to JPEG bytes
     2. Set up Ollama chat with schema enforcement
     3. Process image with specific prompt for structured extraction
     4. Validate response against Label schema
@@ -150,11 +90,11 @@ def perform_structured_ocr(image_path: str, host: str = OLLAMA_HOST, model: str
         Various exceptions for file, API, and validation errors
     """
     try:
-        # Convert image to base64
-        base64_image = image_to_base64(image_path)
+        # Convert image to JPEG bytes, the client base64-encodes them
+        jpeg_image = image_to_jpeg_bytes(image_path)
         
-        # Initialize Ollama client
-        client = Client(host=host)
+        # Reuse the Ollama client for this host
+        client = _get_client(host)
 
         # Process with Gemma using schema enforcement
         response = client.chat(
@@ -179,10 +119,11 @@ def perform_structured_ocr(image_path: str, host: str = OLLAMA_HOST, model: str
                 {
                     "role": "user",
                     "content": "Extract and structure all text from this image according to the schema.",
-                    "images": [base64_image],
+                    "images": [jpeg_image],
                 },
             ],
             stream=False,
+            keep_alive=OCR_KEEP_ALIVE,
         )
         
         # Process response and validate against schema
@@ -216,7 +157,7 @@ if __name__ == "__main__":
     try:
         # Extract text with structured output validation
         result = perform_structured_ocr(image_path)
-        print(json.dumps(result.model_dump(), indent=2))
+        print(orjson.dumps(result.model_dump(), option=orjson.OPT_INDENT_2).decode())
     except Exception as e:
         print(f"\n{Fore.RED}Error:{Style.RESET_ALL} {str(e)}")
 